@@ -1,16 +1,70 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 """Augmentation on foreground and background."""
 
+import mmap
 import numbers
+import os
 import os.path as osp
+import struct
+from collections.abc import Sequence
 
+import cv2
 import mmcv
 import numpy as np
 from mmcv.transforms import BaseTransform
 from mmengine.fileio import get_file_backend
 
 from mmagic.registry import TRANSFORMS
-from mmagic.utils import add_gaussian_noise, adjust_gamma
+from mmagic.utils import RandomIndexBuffer, add_gaussian_noise, adjust_gamma
+
+# cv2 flags to decode jpeg images at 1/2, 1/4 and 1/8 scales
+_REDUCED_IMREAD_FLAGS = {
+    'color': {
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8
+    },
+    'grayscale': {
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+    }
+}
+
+
+def _get_jpeg_size(content):
+    """Get the size of a jpeg image from its SOF segment.
+
+    Args:
+        content (bytes): The content of the image file.
+
+    Returns:
+        tuple[int] | None: The size (h, w) of the image, or None if the
+        content is not a jpeg image.
+    """
+    if content[:2] != b'\xff\xd8':
+        return None
+
+    pos = 2
+    while pos + 9 <= len(content):
+        if content[pos] != 0xFF:
+            return None
+        marker = content[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            # SOF segment: length, precision, height, width
+            return struct.unpack('>HH', content[pos + 5:pos + 9])
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # standalone markers without length
+            pos += 2
+        elif marker in (0xD9, 0xDA):
+            # reach EOI or SOS before SOF
+            return None
+        else:
+            pos += 2 + struct.unpack('>H', content[pos + 2:pos + 4])[0]
+    return None
 
 
 @TRANSFORMS.register_module()
@@ -49,7 +103,8 @@ class CompositeFg(BaseTransform):
                                                    list) else [alpha_dirs]
         self.interpolation = interpolation
 
-        self.file_backend = get_file_backend(uri=fg_dirs[0])
+        self.file_backend = get_file_backend(
+            uri=fg_dirs[0], enable_singleton=True)
 
         self.fg_list, self.alpha_list = self._get_file_list(
             self.fg_dirs, self.alpha_dirs)
@@ -266,30 +321,138 @@ class RandomJitter(BaseTransform):
         return self.__class__.__name__ + f'hue_range={self.hue_range}'
 
 
+class _MmapFileList(Sequence):
+    """A list of file paths backed by a memory-mapped list file.
+
+    Only offsets of lines are kept in memory, and a path is decoded from the
+    mapped file when it is accessed. The file is mapped lazily, thus the list
+    can be pickled to dataloader workers.
+
+    Args:
+        list_file (str): Path of the local file containing one file name per
+            line.
+        prefix (str): Prefix joined to file names.
+    """
+
+    def __init__(self, list_file, prefix):
+        self.list_file = list_file
+        self.prefix = prefix
+        self._mmap = None
+
+        # mmap can not map an empty file
+        if os.path.getsize(list_file) == 0:
+            raise ValueError(f'No file names found in {list_file}.')
+        buffer = np.frombuffer(self._get_mmap(), dtype=np.uint8)
+        ends = np.flatnonzero(buffer == ord('\n'))
+        if len(buffer) > 0 and buffer[-1] != ord('\n'):
+            ends = np.append(ends, len(buffer))
+        starts = np.concatenate([[0], ends[:-1] + 1])
+        # skip empty lines
+        keep = ends > starts
+        self._starts = starts[keep].astype(np.uint64)
+        self._ends = ends[keep].astype(np.uint64)
+        del buffer
+        if len(self._starts) == 0:
+            raise ValueError(f'No file names found in {list_file}.')
+
+    def _get_mmap(self):
+        if self._mmap is None:
+            with open(self.list_file, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, idx):
+        start, end = int(self._starts[idx]), int(self._ends[idx])
+        filename = self._get_mmap()[start:end].decode('utf-8').rstrip('\r')
+        return f'{self.prefix}/{filename}'
+
+    def __getstate__(self):
+        # mmap can not be pickled, map again when accessed
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+
 @TRANSFORMS.register_module()
 class RandomLoadResizeBg(BaseTransform):
     """Randomly load a background image and resize it.
 
-    Required key is "fg", added key is "bg".
+    Required key is "fg", added key is "bg". The background is resized with
+    area interpolation for downscaling and bicubic interpolation otherwise.
 
     Args:
         bg_dir (str): Path of directory to load background images from.
         flag (str): Loading flag for images. Default: 'color'.
         channel_order (str): Order of channel, candidates are 'bgr' and 'rgb'.
             Default: 'bgr'.
-        kwargs (dict): Args for file client.
+        bg_list_file (str, optional): Path of a local file listing names of
+            background images in ``bg_dir``, one per line. If given, the
+            directory is not scanned and the list is memory-mapped instead of
+            held as python strings, which suits directories with a huge
+            number of images. Default: None.
     """
 
-    def __init__(self, bg_dir, flag='color', channel_order='bgr'):
+    def __init__(self,
+                 bg_dir,
+                 flag='color',
+                 channel_order='bgr',
+                 bg_list_file=None):
         self.bg_dir = bg_dir
-
-        self.file_backend = get_file_backend(uri=bg_dir)
-        self.bg_list = list(
-            self.file_backend.list_dir_or_file(bg_dir, list_dir=False))
+        self.bg_list_file = bg_list_file
+
+        self.file_backend = get_file_backend(
+            uri=bg_dir, enable_singleton=True)
+        if bg_list_file is None:
+            # join paths once here instead of at every loading
+            self.bg_list = [
+                f'{bg_dir}/{filename}' for filename in
+                self.file_backend.list_dir_or_file(bg_dir, list_dir=False)
+            ]
+        else:
+            self.bg_list = _MmapFileList(bg_list_file, bg_dir)
 
         self.flag = flag
         self.channel_order = channel_order
 
+        self._random_idx = RandomIndexBuffer(len(self.bg_list))
+
+    def _decode(self, img_bytes, h, w):
+        """Decode a background image to be resized to (h, w).
+
+        Jpeg images much larger than the target size are decoded at 1/2, 1/4
+        or 1/8 scale by libjpeg, which scales in the DCT domain and saves
+        both decoding and resizing work.
+
+        Args:
+            img_bytes (bytes): The content of the image file.
+            h (int): The target height.
+            w (int): The target width.
+
+        Returns:
+            np.ndarray: The decoded image.
+        """
+        src_size = _get_jpeg_size(img_bytes)
+        if src_size is not None and self.flag in _REDUCED_IMREAD_FLAGS:
+            # use the short side since EXIF orientation may swap h and w
+            scale = min(src_size) // max(h, w)
+            for factor in (8, 4, 2):
+                if scale < factor:
+                    continue
+                img = cv2.imdecode(
+                    np.frombuffer(img_bytes, np.uint8),
+                    _REDUCED_IMREAD_FLAGS[self.flag][factor])
+                if img is None:
+                    break
+                if img.ndim == 3 and self.channel_order == 'rgb':
+                    img = mmcv.bgr2rgb(img)
+                return img
+
+        return mmcv.imfrombytes(
+            img_bytes, flag=self.flag, channel_order=self.channel_order)
+
     def transform(self, results: dict) -> dict:
         """Transform function.
 
@@ -301,14 +464,20 @@ class RandomLoadResizeBg(BaseTransform):
             dict: A dict containing the processed data and information.
         """
         h, w = results['fg'].shape[:2]
-        idx = np.random.randint(len(self.bg_list))
-        filepath = f'{self.bg_dir}/{self.bg_list[idx]}'
-        img_bytes = self.file_backend.get(filepath)
-        img = mmcv.imfrombytes(
-            img_bytes, flag=self.flag, channel_order=self.channel_order)  # HWC
-        bg = mmcv.imresize(img, (w, h), interpolation='bicubic')
+        idx = self._random_idx()
+        img_bytes = self.file_backend.get(self.bg_list[idx])
+        img = self._decode(img_bytes, h, w)  # HWC
+        # area interpolation is faster and avoids aliasing for downscaling
+        if img.shape[0] >= h and img.shape[1] >= w:
+            interpolation = 'area'
+        else:
+            interpolation = 'bicubic'
+        bg = mmcv.imresize(img, (w, h), interpolation=interpolation)
         results['bg'] = bg
         return results
 
     def __repr__(self):
-        return self.__class__.__name__ + f"(bg_dir='{self.bg_dir}')"
+        return self.__class__.__name__ + (
+            f"(bg_dir='{self.bg_dir}', flag='{self.flag}', "
+            f"channel_order='{self.channel_order}', "
+            f'bg_list_file={self.bg_list_file!r})')
@@ -1,5 +1,7 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import os
 import os.path as osp
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
 import mmcv
@@ -33,7 +35,8 @@ class LoadImageFromFile(BaseTransform):
             argument for :func:``mmcv.imfrombytes``.
             See :func:``mmcv.imfrombytes`` for details.
             candidates are 'cv2', 'turbojpeg', 'pillow', and 'tifffile'.
-            Defaults to None.
+            'turbojpeg' decodes JPEG images with SIMD and falls back to 'cv2'
+            for other formats. Defaults to None.
         use_cache (bool): If True, load all images at once. Default: False.
         to_float32 (bool): Whether to convert the loaded image to a float32
             numpy array. If set to False, the loaded image is an uint8 array.
@@ -41,8 +44,21 @@ class LoadImageFromFile(BaseTransform):
         to_y_channel (bool): Whether to convert the loaded image to y channel.
             Only support 'rgb2ycbcr' and 'rgb2ycbcr'
             Defaults to False.
+        save_original_img (bool): Whether to save the original image in
+            ``ori_[KEY]``. Defaults to False.
         backend_args (dict, optional): Arguments to instantiate the prefix of
             uri corresponding backend. Defaults to None.
+        num_workers (int, optional): Number of threads used to load frames
+            in parallel. If None, ``min(8, num_frames)`` threads are used.
+            Set it to 0 or 1 to load frames sequentially. Only takes effect
+            when a list of paths is given. Defaults to None.
+        copy_ori (bool): Whether to save a copy of the image as the original
+            image. If False, the original image is a view sharing memory
+            with the loaded image, which avoids the copy but reflects
+            in-place modifications by later transforms, e.g.,
+            :class:`FormatTrimap` and :class:`Flip`. Only set it to False
+            when no later transform modifies the image in place.
+            Defaults to True.
     """
 
     def __init__(
@@ -56,6 +72,8 @@ class LoadImageFromFile(BaseTransform):
         to_y_channel: bool = False,
         save_original_img: bool = False,
         backend_args: Optional[dict] = None,
+        num_workers: Optional[int] = None,
+        copy_ori: bool = True,
     ) -> None:
 
         self.key = key
@@ -63,6 +81,7 @@ class LoadImageFromFile(BaseTransform):
         self.channel_order = channel_order
         self.imdecode_backend = imdecode_backend
         self.save_original_img = save_original_img
+        self.copy_ori = copy_ori
 
         if backend_args is None:
             # lasy init at loading
@@ -70,7 +89,12 @@ class LoadImageFromFile(BaseTransform):
             self.file_backend = None
         else:
             self.backend_args = backend_args.copy()
-            self.file_backend = get_file_backend(backend_args=backend_args)
+            self.file_backend = get_file_backend(
+                backend_args=backend_args, enable_singleton=True)
+        # keys in lmdb are file names without extension
+        self._is_lmdb = (
+            self.backend_args is not None
+            and self.backend_args.get('backend', None) == 'lmdb')
 
         # cache
         self.use_cache = use_cache
@@ -79,6 +103,16 @@ class LoadImageFromFile(BaseTransform):
         # convert
         self.to_float32 = to_float32
         self.to_y_channel = to_y_channel
+        # images decoded in color are always 3-dim, unless converted to y
+        # channel or decoded by tifffile, which ignores the flag
+        self._maybe_expand = (
+            color_type != 'color' or to_y_channel
+            or imdecode_backend == 'tifffile')
+
+        # thread pool for frames, lazy init at loading
+        self.num_workers = num_workers
+        self._pool = None
+        self._pool_pid = None
 
     def transform(self, results: dict) -> dict:
         """Functions to load image or frames.
@@ -95,21 +129,17 @@ class LoadImageFromFile(BaseTransform):
             filenames = [str(filenames)]
             is_frames = False
         else:
-            filenames = [str(v) for v in filenames]
+            if not all(isinstance(v, str) for v in filenames):
+                filenames = [str(v) for v in filenames]
             is_frames = True
 
-        images = []
-        shapes = []
+        if is_frames:
+            images = self._load_frames(filenames)
+        else:
+            images = [self._load_and_convert(filenames[0])]
+        shapes = [img.shape for img in images]
         if self.save_original_img:
-            ori_imgs = []
-
-        for filename in filenames:
-            img = self._load_image(filename)
-            img = self._convert(img)
-            images.append(img)
-            shapes.append(img.shape)
-            if self.save_original_img:
-                ori_imgs.append(img.copy())
+            ori_imgs = [self._get_original(img) for img in images]
 
         if not is_frames:
             images = images[0]
@@ -126,6 +156,61 @@ class LoadImageFromFile(BaseTransform):
 
         return results
 
+    def _load_frames(self, filenames: List[str]) -> List[np.ndarray]:
+        """Load frames in parallel with a thread pool.
+
+        Reading bytes and decoding images release the GIL, thus frames of a
+        clip can be loaded concurrently. The order of frames is preserved.
+
+        Args:
+            filenames (list[str]): Paths of frames.
+        Returns:
+            list[np.ndarray]: Frames.
+        """
+        num_workers = self.num_workers
+        if num_workers is None:
+            num_workers = min(8, len(filenames))
+        if num_workers <= 1:
+            return [self._load_and_convert(f) for f in filenames]
+
+        # init backend here to avoid racing on the lazy init in threads
+        if self.file_backend is None:
+            self.file_backend = get_file_backend(
+                uri=filenames[0],
+                backend_args=self.backend_args,
+                enable_singleton=True)
+
+        # threads do not survive fork, re-create the pool in a new process
+        if self._pool is None or self._pool_pid != os.getpid():
+            max_workers = 8 if self.num_workers is None else self.num_workers
+            self._pool = ThreadPoolExecutor(max_workers=max_workers)
+            self._pool_pid = os.getpid()
+
+        return list(self._pool.map(self._load_and_convert, filenames))
+
+    def _load_and_convert(self, filename: str) -> np.ndarray:
+        """Load an image from file and convert it to the require format.
+
+        Args:
+            filename (str): Path of image file.
+        Returns:
+            np.ndarray: Image.
+        """
+        img = self._load_image(filename)
+        return self._convert(img)
+
+    def _get_original(self, img: np.ndarray) -> np.ndarray:
+        """Get the original image to save.
+
+        Args:
+            img (np.ndarray): The loaded image.
+        Returns:
+            np.ndarray: A copy or a view of the image.
+        """
+        if self.copy_ori:
+            return img.copy()
+        return img.view()
+
     def _load_image(self, filename):
         """Load an image from file.
 
@@ -136,10 +221,11 @@ class LoadImageFromFile(BaseTransform):
         """
         if self.file_backend is None:
             self.file_backend = get_file_backend(
-                uri=filename, backend_args=self.backend_args)
+                uri=filename,
+                backend_args=self.backend_args,
+                enable_singleton=True)
 
-        if (self.backend_args is not None) and (self.backend_args.get(
-                'backend', None) == 'lmdb'):
+        if self._is_lmdb:
             filename, _ = osp.splitext(osp.basename(filename))
 
         if filename in self.cache:
@@ -149,11 +235,16 @@ class LoadImageFromFile(BaseTransform):
             if self.use_cache:
                 self.cache[filename] = img_bytes
 
+        imdecode_backend = self.imdecode_backend
+        # turbojpeg can only decode jpeg, which starts with the SOI marker
+        if imdecode_backend == 'turbojpeg' and img_bytes[:2] != b'\xff\xd8':
+            imdecode_backend = 'cv2'
+
         img = mmcv.imfrombytes(
             content=img_bytes,
             flag=self.color_type,
             channel_order=self.channel_order,
-            backend=self.imdecode_backend)
+            backend=imdecode_backend)
 
         return img
 
@@ -176,8 +267,8 @@ class LoadImageFromFile(BaseTransform):
                 raise ValueError('Currently support only "bgr2ycbcr" or '
                                  '"bgr2ycbcr".')
 
-        if img.ndim == 2:
-            img = np.expand_dims(img, axis=2)
+        if self._maybe_expand and img.ndim == 2:
+            img = img[..., None]
 
         if self.to_float32:
             img = img.astype(np.float32)
@@ -195,10 +286,19 @@ class LoadImageFromFile(BaseTransform):
                     f'to_float32={self.to_float32}, '
                     f'to_y_channel={self.to_y_channel}, '
                     f'save_original_img={self.save_original_img}, '
-                    f'backend_args={self.backend_args})')
+                    f'backend_args={self.backend_args}, '
+                    f'num_workers={self.num_workers}, '
+                    f'copy_ori={self.copy_ori})')
 
         return repr_str
 
+    def __getstate__(self):
+        # thread pool can not be pickled, drop it and re-create when loading
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_pool_pid'] = None
+        return state
+
 
 @TRANSFORMS.register_module()
 class LoadMask(BaseTransform):
@@ -244,8 +344,10 @@ class LoadMask(BaseTransform):
             mask_list_file='xxx/xxx/ooxx.txt',
             prefix='/xxx/xxx/ooxx/',
             io_backend='local',
-            color_type='unchanged',
-            file_client_kwargs=dict()
+            color_type='grayscale',
+            file_client_kwargs=dict(),
+            cache_in_memory=False,
+            cache_bytes_limit=None
         )
 
         The mask_list_file contains the list of mask file name like this:
@@ -256,6 +358,14 @@ class LoadMask(BaseTransform):
 
         The prefix gives the data path.
 
+        The color_type defaults to 'grayscale', which decodes a single
+        channel only. With other flags, e.g. 'unchanged', the first channel
+        of the decoded mask is used.
+
+        If cache_in_memory is True, decoded masks are kept in memory once
+        loaded, until their total size exceeds cache_bytes_limit. Note that
+        each dataloader worker holds its own cache.
+
     Args:
         mask_mode (str): Mask mode in ['bbox', 'irregular', 'ff', 'set',
             'file']. Default: 'bbox'.
@@ -280,7 +390,7 @@ class LoadMask(BaseTransform):
         if self.mask_mode == 'set':
             # get mask list information
             self.io_backend = self.mask_config['io_backend']
-            self.color_type = self.mask_config['color_type']
+            self.color_type = self.mask_config.get('color_type', 'grayscale')
             self.file_prefix = self.mask_config['prefix']
             self.file_client_kwargs = self.mask_config['file_client_kwargs']
             self.file_backend = None
@@ -292,6 +402,16 @@ class LoadMask(BaseTransform):
                 osp.join(self.file_prefix, i) for i in self.mask_list
             ]
             self.mask_set_size = len(self.mask_list)
+
+            # cache of decoded masks
+            self.cache_in_memory = self.mask_config.get(
+                'cache_in_memory', False)
+            self.cache_bytes_limit = self.mask_config.get(
+                'cache_bytes_limit', None)
+            self.mask_cache = dict()
+            self.mask_cache_bytes = 0
+
+            self._random_idx = RandomIndexBuffer(self.mask_set_size)
         elif self.mask_mode == 'file':
             self.io_backend = 'local'
             self.color_type = 'unchanged'
@@ -301,32 +421,52 @@ class LoadMask(BaseTransform):
     def _get_random_mask_from_set(self):
         if self.file_backend is None:
             self.file_backend = get_file_backend(
-                backend_args={'backend': self.io_backend})
-        # minus 1 to avoid out of range error
-        mask_idx = np.random.randint(0, self.mask_set_size)
-        mask_bytes = self.file_backend.get(self.mask_list[mask_idx])
-        mask = mmcv.imfrombytes(mask_bytes, flag=self.color_type)  # HWC, BGR
-        if mask.ndim == 2:
-            mask = np.expand_dims(mask, axis=2)
-        else:
-            mask = mask[:, :, 0:1]
+                backend_args={'backend': self.io_backend},
+                enable_singleton=True)
+        mask_idx = self._random_idx()
+        if mask_idx in self.mask_cache:
+            # copy since masks may be modified in place by later transforms
+            return self.mask_cache[mask_idx].copy()
 
-        mask[mask > 0] = 1.
+        mask_bytes = self.file_backend.get(self.mask_list[mask_idx])
+        mask = self._decode_mask(mask_bytes)
+        if self.cache_in_memory and (
+                self.cache_bytes_limit is None or self.mask_cache_bytes +
+                mask.nbytes <= self.cache_bytes_limit):
+            self.mask_cache[mask_idx] = mask.copy()
+            self.mask_cache_bytes += mask.nbytes
         return mask
 
     def _get_mask_from_file(self, path):
         if self.file_backend is None:
             backend_args = self.file_client_kwargs.copy()
             backend_args['backend'] = self.io_backend
-            self.file_backend = get_file_backend(backend_args=backend_args)
+            self.file_backend = get_file_backend(
+                backend_args=backend_args, enable_singleton=True)
         mask_bytes = self.file_backend.get(path)
+        return self._decode_mask(mask_bytes)
+
+    def _decode_mask(self, mask_bytes):
+        """Decode a mask and binarize it in place.
+
+        Args:
+            mask_bytes (bytes): The content of the mask file.
+
+        Returns:
+            np.ndarray: Mask in the shape of (h, w, 1).
+        """
         mask = mmcv.imfrombytes(mask_bytes, flag=self.color_type)  # HWC, BGR
         if mask.ndim == 2:
-            mask = np.expand_dims(mask, axis=2)
+            mask = mask[..., None]
         else:
-            mask = mask[:, :, 0:1]
+            # do not keep the whole multi-channel buffer alive
+            mask = np.ascontiguousarray(mask[:, :, 0:1])
 
-        mask[mask > 0] = 1.
+        if mask.dtype.kind == 'u':
+            # avoid allocating a temporary boolean array for indexing
+            np.minimum(mask, 1, out=mask)
+        else:
+            mask[mask > 0] = 1.
         return mask
 
     def transform(self, results):
@@ -469,6 +609,9 @@ class LoadPairedImageFromFile(LoadImageFromFile):
             uri corresponding backend. Defaults to None.
         io_backend (str, optional): io backend where images are store. Defaults
             to None.
+        copy_ori (bool): Whether to save copies of images as the original
+            images. If False, views sharing memory with the loaded images
+            are saved. Defaults to True.
     """
 
     def __init__(self,
@@ -482,10 +625,19 @@ class LoadPairedImageFromFile(LoadImageFromFile):
                  to_float32: bool = False,
                  to_y_channel: bool = False,
                  save_original_img: bool = False,
-                 backend_args: Optional[dict] = None):
-        super().__init__(key, color_type, channel_order, imdecode_backend,
-                         use_cache, to_float32, to_y_channel,
-                         save_original_img, backend_args)
+                 backend_args: Optional[dict] = None,
+                 copy_ori: bool = True):
+        super().__init__(
+            key,
+            color_type,
+            channel_order,
+            imdecode_backend,
+            use_cache,
+            to_float32,
+            to_y_channel,
+            save_original_img,
+            backend_args,
+            copy_ori=copy_ori)
         assert isinstance(domain_a, str)
         assert isinstance(domain_b, str)
         self.domain_a = domain_a
@@ -506,7 +658,7 @@ class LoadPairedImageFromFile(LoadImageFromFile):
         image = self._load_image(filename)
         image = self._convert(image)
         if self.save_original_img:
-            ori_image = image.copy()
+            ori_image = self._get_original(image)
         shape = image.shape
 
         # crop pair into a and b
@@ -525,8 +677,16 @@ class LoadPairedImageFromFile(LoadImageFromFile):
         results[f'img_{self.domain_a}_ori_shape'] = image_a.shape
         results[f'img_{self.domain_b}_ori_shape'] = image_b.shape
         if self.save_original_img:
-            results[f'ori_img_{self.domain_a}'] = image_a.copy()
-            results[f'ori_img_{self.domain_b}'] = image_b.copy()
+            if self.copy_ori:
+                # crop from the copied original image rather than copying
+                # each half again
+                ori_image_a = ori_image[:, :new_w, :]
+                ori_image_b = ori_image[:, new_w:, :]
+            else:
+                ori_image_a = self._get_original(image_a)
+                ori_image_b = self._get_original(image_b)
+            results[f'ori_img_{self.domain_a}'] = ori_image_a
+            results[f'ori_img_{self.domain_b}'] = ori_image_b
 
         results[self.key] = image
         results[f'ori_{self.key}_shape'] = shape
@@ -7,9 +7,10 @@ from .io_utils import MMAGIC_CACHE_DIR, download_from_url
 from .logger import print_colored_log
 from .sampler import get_sampler
 from .setup_env import register_all_modules, try_import
-from .trans_utils import (add_gaussian_noise, adjust_gamma, bbox2mask,
-                          brush_stroke_mask, get_irregular_mask, make_coord,
-                          random_bbox, random_choose_unknown)
+from .trans_utils import (RandomIndexBuffer, add_gaussian_noise,
+                          adjust_gamma, bbox2mask, brush_stroke_mask,
+                          get_irregular_mask, make_coord, random_bbox,
+                          random_choose_unknown)
 from .typing import ConfigType, ForwardInputs, LabelVar, NoiseVar, SampleList
 
 __all__ = [
@@ -19,5 +20,5 @@ __all__ = [
     'random_choose_unknown', 'add_gaussian_noise', 'adjust_gamma',
     'make_coord', 'bbox2mask', 'brush_stroke_mask', 'get_irregular_mask',
     'random_bbox', 'reorder_image', 'to_numpy', 'get_box_info',
-    'can_convert_to_image', 'all_to_tensor'
+    'can_convert_to_image', 'all_to_tensor', 'RandomIndexBuffer'
 ]
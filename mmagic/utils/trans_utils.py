@@ -2,6 +2,7 @@
 
 import logging
 import math
+import os
 
 import cv2
 import numpy as np
@@ -346,14 +347,61 @@ def get_irregular_mask(img_shape, area_ratio_range=(0.15, 0.5), **kwargs):
 
     mask = random_irregular_mask(img_shape, **kwargs)
     min_ratio, max_ratio = area_ratio_range
+    area = img_shape[0] * img_shape[1]
 
-    while not min_ratio < (np.sum(mask) /
-                           (img_shape[0] * img_shape[1])) < max_ratio:
+    # the mask is binary, counting is cheaper than summing with upcasting
+    while not min_ratio < np.count_nonzero(mask) / area < max_ratio:
         mask = random_irregular_mask(img_shape, **kwargs)
 
     return mask
 
 
+class RandomIndexBuffer:
+    """Draw random indices in ``[0, size)`` in blocks.
+
+    Calling ``np.random.randint`` once per sample is slow compared to
+    drawing a whole block at once. Note that the first call consumes
+    ``block_size`` values from the global ``np.random`` stream.
+
+    The buffer is re-drawn in a new process, so that workers forked from
+    the same parent do not share indices, and it is dropped at pickling.
+
+    Args:
+        size (int): Number of candidates to draw the indices from.
+        block_size (int): Number of indices drawn at once. Default: 4096.
+    """
+
+    def __init__(self, size, block_size=4096):
+        self.size = size
+        self.block_size = block_size
+        self._buffer = None
+        self._pos = 0
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffer'] = None
+        state['_pos'] = 0
+        state['_pid'] = None
+        return state
+
+    def __call__(self):
+        """Get the next random index.
+
+        Returns:
+            int: The random index.
+        """
+        if (self._buffer is None or self._pos >= len(self._buffer)
+                or self._pid != os.getpid()):
+            self._buffer = np.random.randint(
+                0, self.size, size=self.block_size)
+            self._pos = 0
+            self._pid = os.getpid()
+        idx = self._buffer[self._pos]
+        self._pos += 1
+        return idx
+
+
 _integer_types = (
     np.byte,
     np.ubyte,  # 8 bits
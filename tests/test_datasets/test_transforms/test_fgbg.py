@@ -1,12 +1,16 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import pickle
+import re
 from pathlib import Path
 
+import mmcv
 import numpy as np
 import pytest
 from mmengine.fileio import load
 
 from mmagic.datasets.transforms import (CompositeFg, MergeFgAndBg, PerturbBg,
                                         RandomJitter, RandomLoadResizeBg)
+from mmagic.datasets.transforms.fgbg import _get_jpeg_size
 
 test_root = Path(__file__).parent.parent.parent
 data_root = test_root / 'data' / 'matting_dataset'
@@ -144,7 +148,7 @@ def test_random_jitter():
         'hue_range=(-50, 50)')
 
 
-def test_random_load_resize_bg():
+def test_random_load_resize_bg(tmp_path):
     ann_file = data_root / 'ann_old.json'
     bg_dir = data_root / 'bg'
     data_infos = load(ann_file)
@@ -163,8 +167,76 @@ def test_random_load_resize_bg():
         assert isinstance(random_load_bg_results['bg'], np.ndarray)
         assert random_load_bg_results['bg'].shape == (128, 128, 3)
 
-    assert repr(
-        random_load_bg) == f"RandomLoadResizeBg(bg_dir='{str(bg_dir)}')"
+    assert repr(random_load_bg) == (
+        f"RandomLoadResizeBg(bg_dir='{str(bg_dir)}', flag='color', "
+        "channel_order='bgr', bg_list_file=None)")
+
+    # test bg larger than fg is decoded at a reduced scale
+    bg = mmcv.imread(str(bg_dir / 'GT26r.jpg'))
+    assert _get_jpeg_size((bg_dir / 'GT26r.jpg').read_bytes()) == bg.shape[:2]
+    for channel_order in ['bgr', 'rgb']:
+        random_load_bg = RandomLoadResizeBg(
+            bg_dir=bg_dir, channel_order=channel_order)
+        for fg_size in [64, 512]:
+            results = dict(fg=np.random.rand(fg_size, fg_size))
+            bg_results = random_load_bg(results)
+            assert bg_results['bg'].shape == (fg_size, fg_size, 3)
+
+    random_load_bg = RandomLoadResizeBg(bg_dir=bg_dir, flag='grayscale')
+    bg_results = random_load_bg(dict(fg=np.random.rand(64, 64)))
+    assert bg_results['bg'].shape == (64, 64)
+
+    # test the scale of reduced decoding, GT26r.jpg is 552x800
+    bg_bytes = (bg_dir / 'GT26r.jpg').read_bytes()
+    random_load_bg = RandomLoadResizeBg(bg_dir=bg_dir)
+    assert random_load_bg._decode(bg_bytes, 64, 64).shape == (69, 100, 3)
+    assert random_load_bg._decode(bg_bytes, 128, 128).shape == (138, 200, 3)
+    assert random_load_bg._decode(bg_bytes, 200, 200).shape == (276, 400, 3)
+    assert random_load_bg._decode(bg_bytes, 300, 300).shape == (552, 800, 3)
+    random_load_bg = RandomLoadResizeBg(bg_dir=bg_dir, channel_order='rgb')
+    img = random_load_bg._decode(bg_bytes, 64, 64)
+    random_load_bg = RandomLoadResizeBg(bg_dir=bg_dir)
+    np.testing.assert_array_equal(
+        img, random_load_bg._decode(bg_bytes, 64, 64)[..., ::-1])
+    random_load_bg = RandomLoadResizeBg(bg_dir=bg_dir, flag='grayscale')
+    assert random_load_bg._decode(bg_bytes, 64, 64).shape == (69, 100)
+
+    # test fallback to full decoding for flag without reduced decoding
+    random_load_bg = RandomLoadResizeBg(bg_dir=bg_dir, flag='unchanged')
+    assert random_load_bg._decode(bg_bytes, 64, 64).shape == (552, 800, 3)
+
+    # test fallback to full decoding for non-jpeg content
+    png_path = data_root / 'trimap' / 'GT05.png'
+    png = mmcv.imread(str(png_path))
+    random_load_bg = RandomLoadResizeBg(bg_dir=bg_dir)
+    img = random_load_bg._decode(png_path.read_bytes(), 8, 8)
+    np.testing.assert_array_equal(img, png)
+
+    # test bg_list_file
+    bg_list_file = tmp_path / 'bg_list.txt'
+    bg_list_file.write_text('GT26r.jpg\n\nGT26r.jpg')
+    random_load_bg = RandomLoadResizeBg(
+        bg_dir=bg_dir, bg_list_file=str(bg_list_file))
+    assert len(random_load_bg.bg_list) == 2
+    assert random_load_bg.bg_list[1] == f'{bg_dir}/GT26r.jpg'
+    assert repr(random_load_bg) == (
+        f"RandomLoadResizeBg(bg_dir='{str(bg_dir)}', flag='color', "
+        f"channel_order='bgr', bg_list_file='{str(bg_list_file)}')")
+    random_load_bg = pickle.loads(pickle.dumps(random_load_bg))
+    bg_results = random_load_bg(dict(fg=np.random.rand(64, 64)))
+    assert bg_results['bg'].shape == (64, 64, 3)
+
+    # test empty bg_list_file
+    for i, content in enumerate(['', '\n\n']):
+        empty_list_file = tmp_path / f'empty_{i}.txt'
+        empty_list_file.write_text(content)
+        with pytest.raises(ValueError, match=re.escape(str(empty_list_file))):
+            RandomLoadResizeBg(
+                bg_dir=bg_dir, bg_list_file=str(empty_list_file))
+
+    # test non-jpeg content
+    assert _get_jpeg_size(b'\x89PNG\r\n\x1a\n') is None
+    assert _get_jpeg_size(b'\xff\xd8\xff\xd9') is None
 
 
 def teardown_module():
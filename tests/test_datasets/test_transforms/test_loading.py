@@ -1,4 +1,5 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import pickle
 from pathlib import Path
 
 import mmcv
@@ -6,8 +7,9 @@ import numpy as np
 import pytest
 from mmengine.fileio.backends import LocalBackend
 
-from mmagic.datasets.transforms import (GetSpatialDiscountMask,
-                                        LoadImageFromFile, LoadMask)
+from mmagic.datasets.transforms import (FormatTrimap, GetSpatialDiscountMask,
+                                        LoadImageFromFile, LoadMask,
+                                        LoadPairedImageFromFile)
 
 
 def test_load_image_from_file():
@@ -62,7 +64,8 @@ def test_load_image_from_file():
         ('(key=img, color_type=color, channel_order=bgr, '
          'imdecode_backend=None, use_cache=False, to_float32=False, '
          'to_y_channel=False, save_original_img=False, '
-         'backend_args=None)'))
+         'backend_args=None, num_workers=None, '
+         'copy_ori=True)'))
     assert isinstance(image_loader.file_backend, LocalBackend)
 
     # test save_original_img
@@ -76,6 +79,30 @@ def test_load_image_from_file():
     assert id(results['ori_img']) != id(results['img'])
     assert results['img_channel_order'] == 'bgr'
     assert results['img_color_type'] == 'grayscale'
+    # the original image is a copy by default
+    assert not np.shares_memory(results['ori_img'], results['img'])
+
+    # test copy_ori=False
+    results = dict(img_path=path_baboon)
+    config = dict(key='img', save_original_img=True, copy_ori=False)
+    image_loader = LoadImageFromFile(**config)
+    results = image_loader(results)
+    np.testing.assert_almost_equal(results['ori_img'], results['img'])
+    assert id(results['ori_img']) != id(results['img'])
+    assert np.shares_memory(results['ori_img'], results['img'])
+
+    # in-place transforms should not modify the original trimap
+    path_trimap = Path(__file__).parent.parent.parent / 'data' / \
+        'matting_dataset' / 'trimap' / 'GT05.png'
+    img_trimap = mmcv.imread(str(path_trimap), flag='grayscale')
+    results = dict(trimap_path=path_trimap)
+    config = dict(key='trimap', color_type='grayscale', save_original_img=True)
+    image_loader = LoadImageFromFile(**config)
+    results = FormatTrimap(to_onehot=False)(image_loader(results))
+    assert set(np.unique(results['trimap'])).issubset({0, 1, 2})
+    np.testing.assert_array_equal(results['ori_trimap'][..., 0], img_trimap)
+    assert (results['ori_trimap'] == 128).any()
+    assert set(np.unique(results['ori_trimap'])).issubset({0, 128, 255})
 
     # test: use_cache
     results = dict(gt_path=path_baboon)
@@ -87,7 +114,8 @@ def test_load_image_from_file():
         ('(key=gt, color_type=color, channel_order=bgr, '
          'imdecode_backend=None, use_cache=True, to_float32=False, '
          'to_y_channel=False, save_original_img=False, '
-         'backend_args=None)'))
+         'backend_args=None, num_workers=None, '
+         'copy_ori=True)'))
     results = image_loader(results)
     assert image_loader.cache is not None
     assert str(path_baboon) in image_loader.cache
@@ -98,6 +126,13 @@ def test_load_image_from_file():
     assert results['gt_channel_order'] == 'bgr'
     assert results['gt_color_type'] == 'color'
 
+    # test turbojpeg falls back to cv2 for non-jpeg images
+    results = dict(gt_path=path_baboon)
+    config = dict(key='gt', imdecode_backend='turbojpeg')
+    image_loader = LoadImageFromFile(**config)
+    results = image_loader(results)
+    np.testing.assert_almost_equal(results['gt'], img_baboon)
+
     # convert to y-channel (bgr2y)
     results = dict(gt_path=path_baboon)
     config = dict(key='gt', to_y_channel=True, to_float32=True)
@@ -140,6 +175,23 @@ def test_load_image_from_file():
     np.testing.assert_almost_equal(results['gt'][0], img_baboon)
     assert results['gt_path'] == [str(path_baboon)]
 
+    # test frames loaded in parallel, the order should be preserved
+    results = dict(gt_path=[path_baboon, path_baboon_x4, path_baboon])
+    config = dict(key='gt', num_workers=2)
+    image_loader = LoadImageFromFile(**config)
+    results = image_loader(results)
+    assert results['ori_gt_shape'] == [(h, w, 3), (h // 4, w // 4, 3),
+                                       (h, w, 3)]
+    np.testing.assert_almost_equal(results['gt'][0], img_baboon)
+    np.testing.assert_almost_equal(results['gt'][1], img_baboon_x4)
+    np.testing.assert_almost_equal(results['gt'][2], img_baboon)
+    # the thread pool should not be pickled
+    image_loader = pickle.loads(pickle.dumps(image_loader))
+    assert image_loader._pool is None
+    results = image_loader(dict(gt_path=[path_baboon_x4, path_baboon]))
+    np.testing.assert_almost_equal(results['gt'][0], img_baboon_x4)
+    np.testing.assert_almost_equal(results['gt'][1], img_baboon)
+
     # test lmdb
     results = dict(img_path=path_baboon)
     config = dict(
@@ -179,6 +231,36 @@ def test_load_image_from_file():
         assert results['img'] == 'openmmlab:s3://abcd/efg/'
 
 
+def test_load_paired_image_from_file():
+
+    path_pair = Path(
+        __file__).parent.parent.parent / 'data' / 'paired' / 'train' / '1.jpg'
+    img_pair = mmcv.imread(str(path_pair), flag='color')
+    h, w, _ = img_pair.shape
+
+    for copy_ori in [False, True]:
+        loader = LoadPairedImageFromFile(
+            key='pair', save_original_img=True, copy_ori=copy_ori)
+        results = loader(dict(pair_path=str(path_pair)))
+        np.testing.assert_almost_equal(results['pair'], img_pair)
+        np.testing.assert_almost_equal(results['img_A'],
+                                       img_pair[:, :w // 2])
+        np.testing.assert_almost_equal(results['img_B'],
+                                       img_pair[:, w // 2:])
+        np.testing.assert_almost_equal(results['ori_pair'], img_pair)
+        np.testing.assert_almost_equal(results['ori_img_A'],
+                                       img_pair[:, :w // 2])
+        np.testing.assert_almost_equal(results['ori_img_B'],
+                                       img_pair[:, w // 2:])
+        # original halves are cropped from the original pair
+        assert np.shares_memory(results['ori_img_A'], results['ori_pair'])
+        assert np.shares_memory(results['ori_img_B'], results['ori_pair'])
+        assert np.shares_memory(results['ori_pair'],
+                                results['pair']) != copy_ori
+        assert np.shares_memory(results['ori_img_A'],
+                                results['img_A']) != copy_ori
+
+
 def test_dct_mask():
     mask = np.zeros((64, 64, 1))
     mask[20:40, 20:40] = 1.
@@ -252,6 +334,53 @@ class TestInpaintLoading:
         gt_mask = np.expand_dims(gt_mask, axis=2)
         assert np.array_equal(results['mask'], gt_mask[..., 0:1] / 255.)
 
+        # test mask mode: set with color_type defaults to grayscale
+        mask_config = dict(
+            mask_list_file='tests/data/inpainting/mask_list_single_ch.txt',
+            prefix='tests/data/inpainting/',
+            io_backend='local',
+            file_client_kwargs=dict())
+        set_loader = LoadMask('set', mask_config)
+        assert set_loader.color_type == 'grayscale'
+        results = set_loader(dict())
+        assert np.array_equal(results['mask'], gt_mask / 255.)
+        assert results['mask'].flags.c_contiguous
+
+        # test mask mode: set with cache in memory
+        mask_config = dict(
+            mask_list_file='tests/data/inpainting/mask_list.txt',
+            prefix='tests/data/inpainting/',
+            io_backend='local',
+            color_type='unchanged',
+            file_client_kwargs=dict(),
+            cache_in_memory=True)
+        set_loader = LoadMask('set', mask_config)
+        gt_mask = mmcv.imread(
+            'tests/data/inpainting/mask/test.png', flag='unchanged')
+        for _ in range(2):
+            results = set_loader(dict())
+            assert np.array_equal(results['mask'], gt_mask[..., 0:1] / 255.)
+            assert len(set_loader.mask_cache) == 1
+            assert not np.shares_memory(results['mask'],
+                                        set_loader.mask_cache[0])
+        assert set_loader.mask_cache_bytes == set_loader.mask_cache[0].nbytes
+
+        # test mask mode: set with random indices re-drawn after pickling
+        assert set_loader._random_idx._buffer is not None
+        set_loader = pickle.loads(pickle.dumps(set_loader))
+        assert set_loader._random_idx._buffer is None
+        results = set_loader(dict())
+        assert np.array_equal(results['mask'], gt_mask[..., 0:1] / 255.)
+        assert len(set_loader._random_idx._buffer) == 4096
+        assert set_loader._random_idx._pos == 1
+
+        # test mask mode: set with cache exceeding the limit
+        mask_config['cache_bytes_limit'] = 0
+        set_loader = LoadMask('set', mask_config)
+        results = set_loader(dict())
+        assert np.array_equal(results['mask'], gt_mask[..., 0:1] / 255.)
+        assert len(set_loader.mask_cache) == 0
+
         # test mask mode: ff
         mask_config = dict(
             img_shape=(256, 256),
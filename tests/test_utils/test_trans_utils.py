@@ -1,4 +1,5 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+import pickle
 from pathlib import Path
 
 import numpy as np
@@ -6,8 +7,8 @@ import pytest
 
 from mmagic.datasets.transforms import (CropAroundCenter, CropAroundFg,
                                         CropAroundUnknown, LoadImageFromFile)
-from mmagic.utils import (adjust_gamma, bbox2mask, brush_stroke_mask,
-                          get_irregular_mask, random_bbox)
+from mmagic.utils import (RandomIndexBuffer, adjust_gamma, bbox2mask,
+                          brush_stroke_mask, get_irregular_mask, random_bbox)
 
 dtype_range = {
     np.bool_: (False, True),
@@ -394,6 +395,34 @@ def test_irregular_mask():
     assert mask.shape == (256, 256, 1)
 
 
+
+def test_random_index_buffer():
+    random_idx = RandomIndexBuffer(3, block_size=4)
+    np.random.seed(0)
+    indices = [random_idx() for _ in range(4)]
+    np.random.seed(0)
+    assert indices == np.random.randint(0, 3, size=4).tolist()
+
+    # re-draw the next block after exhausting the buffer
+    buffer = random_idx._buffer
+    idx = random_idx()
+    assert random_idx._buffer is not buffer
+    assert random_idx._pos == 1
+    assert idx == random_idx._buffer[0]
+    assert all(0 <= random_idx() < 3 for _ in range(10))
+
+    # the buffer is dropped at pickling and re-drawn at the next call
+    np.random.seed(1)
+    random_idx = pickle.loads(pickle.dumps(random_idx))
+    assert random_idx._buffer is None
+    assert random_idx.size == 3 and random_idx.block_size == 4
+    idx = random_idx()
+    np.random.seed(1)
+    expected = np.random.randint(0, 3, size=4)
+    np.testing.assert_array_equal(random_idx._buffer, expected)
+    assert idx == expected[0]
+
+
 def teardown_module():
     import gc
     gc.collect()